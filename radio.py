@@ -6,18 +6,79 @@ import threading
 import time
 import queue
 import socket
-from flask import Flask, Response, request, jsonify, render_template_string
-import tkinter as tk
-from tkinter import ttk
+import mmap
+import tempfile
+import atexit
+import json
+import sys
+import argparse
+import bisect
+import gzip
+import zlib
+from collections import deque
+
+STARTED_AT = time.monotonic()  # medido antes do import do Flask: tempo até o primeiro byte
+
+from flask import Flask, Response, request, jsonify, render_template_string, send_from_directory, abort, redirect
+
+# opcionais: brotli para /files e /playlist comprimidos, msgpack para a codificação binária
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 app = Flask(__name__)
 
 # ---------- CONFIGURAÇÃO ----------
 PORT = 8080
 CHUNK_SIZE = 1024
+CLIENT_QUEUE_SIZE = 512  # chunks pendentes por ouvinte
+WRITE_BATCH_BYTES = 32 * 1024  # cada escrita para o ouvinte junta até isso de chunks pendentes
+WRITE_COALESCE_SECONDS = 0.2   # quanto esperar por mais chunks antes de escrever (0 = não espera)
+COMPRESS_MIN_BYTES = 1024  # respostas de controle menores que isso vão sem compressão
+# perfil de latência: "normal" usa os valores acima; "low" (ou --latency low) aplica
+# LOW_LATENCY_SETTINGS: chunks do tamanho de um frame, filas rasas e sem agrupamento
+LATENCY_PROFILE = "normal"
+LOW_LATENCY = False  # ligado pelo perfil "low": ffmpeg com -flush_packets e leituras parciais
+LOW_LATENCY_SETTINGS = {
+    "LOW_LATENCY": True,
+    "CHUNK_SIZE": 627,  # um frame a 192 kbps / 44,1 kHz
+    "CLIENT_QUEUE_SIZE": 16,
+    "WRITE_BATCH_BYTES": 4096,
+    "WRITE_COALESCE_SECONDS": 0,
+}
+# metadados ICY (título da faixa dentro do stream) para players que enviam Icy-MetaData: 1
+ICY_METAINT = 16000
+ICY_NAME = "Estação Rádio"
 FFMPEG_BIN = "ffmpeg"
 MUSIC_FOLDER = r"C:\Users\filip\OneDrive\Desktop\codigos\pessoal\outros\music"
 ALLOWED_EXT = {'.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac'}
+# índice da biblioteca salvo a cada scan; permite tocar antes de o scan terminar
+PLAYLIST_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "playlist_cache.json")
+BITRATE_KBPS = 192
+# timeshift: últimos N segundos da transmissão num arquivo circular (0 desativa)
+TIMESHIFT_SECONDS = 45 * 60
+TIMESHIFT_DIR = None  # pasta do arquivo do ring (None = pasta temporária do sistema)
+TIMESHIFT_BURST_SECONDS = 10  # quanto um ouvinte atrasado pode receber adiantado
+# arquivo contínuo: grava a transmissão em segmentos de uma hora (None desativa)
+ARCHIVE_FOLDER = None
+ARCHIVE_SEGMENT_SECONDS = 3600
+# controle de admissão em /stream (0 = sem limite)
+MAX_LISTENERS = 200
+MAX_LISTENERS_PER_IP = 8
+MAX_EGRESS_KBPS = 0  # banda total de saída estimada (ouvintes x BITRATE_KBPS)
+RETRY_AFTER_SECONDS = 30
+OVERFLOW_REDIRECT_URL = None  # ex.: stream com bitrate menor para quem exceder o limite
+# supervisão do ffmpeg
+ENCODER_WATCHDOG_SECONDS = 10      # leitura sem nenhuma saída por mais que isso = encoder travado
+ENCODER_BACKOFF_SECONDS = (0.5, 30)  # espera inicial e máxima entre reinícios
+ENCODER_QUARANTINE_AFTER = 3       # falhas seguidas até o arquivo ser ignorado
+ENCODER_QUARANTINE_SECONDS = 15 * 60  # depois disso o arquivo volta a ser tentado (0 = só no rescan)
+ENCODER_STDERR_LINES_PER_SEC = 5   # linhas de stderr logadas por segundo (o resto é contado)
 # -----------------------------------
 
 state_lock = threading.Lock()
@@ -31,21 +92,48 @@ clients = set()
 skip_event = threading.Event()
 action_pending = None
 action_pending_index = None  # usado para saltos diretos
+timeshift = None  # TimeshiftRing, criado em start_broadcaster()
+published_bytes = 0  # total de bytes publicados pelo broadcaster (offset do stream ao vivo)
+publish_log = deque(maxlen=8192)  # (offset final, time.time()) de cada chunk publicado
+# protege published_bytes junto com a lista de destinatários de cada chunk, para que
+# o X-Stream-Offset de uma conexão nova corresponda ao primeiro chunk da fila dela
+publish_lock = threading.Lock()
+# vezes em que chunks do ao vivo foram descartados de filas de ouvintes (skip, perfil
+# low); depois disso X-Stream-Offset + bytes recebidos deixa de valer naquela conexão
+stream_gaps = 0
+icy_block = b"\0"  # bloco de metadados ICY da faixa atual, montado uma vez por troca de faixa
+chunk_pool = None  # BufferPool com os buffers de leitura do encoder, criado em start_broadcaster()
+recorder = None  # ArchiveRecorder, criado em start_broadcaster() se ARCHIVE_FOLDER estiver definido
+first_listener_byte_ms = None  # tempo do início do processo até o primeiro byte entregue a um ouvinte
+# versões do estado: incrementadas (com state_lock) a cada mudança, para que a UI
+# e os caches saibam o que mudou sem copiar a playlist
+state_version = 0     # índice, pausa, loop ou playlist
+playlist_version = 0  # só a playlist
 
 
 def log(msg):
     print(f"[radio] {msg}", flush=True)
 
 
+def touch_state(playlist_changed=False):
+    """Registra uma mudança de estado. Deve ser chamada com state_lock adquirido."""
+    global state_version, playlist_version
+    state_version += 1
+    if playlist_changed:
+        playlist_version += 1
+
+
 def scan_playlist():
     """Atualiza a lista de músicas; cada arquivo recebe um ID interno de 3 dígitos.
     Retorna o número de arquivos encontrados."""
-    global playlist
+    global playlist, index
     found = []
     try:
         if not os.path.exists(MUSIC_FOLDER):
             log(f"Pasta não existe: {MUSIC_FOLDER}")
-            playlist = []
+            with state_lock:
+                playlist = []
+                touch_state(playlist_changed=True)
             return 0
         for root, _, files in os.walk(MUSIC_FOLDER):
             for fname in sorted(files):
@@ -60,25 +148,643 @@ def scan_playlist():
             id_str = f"{i:03d}"
             new_pl.append({ 'id': id_str, 'path': p, 'name': os.path.basename(p) })
         with state_lock:
-            playlist = new_pl
+            cur_path = playlist[index]['path'] if 0 <= index < len(playlist) else None
+            old_index = index
+            changed = [(p['id'], p['path']) for p in playlist] != [(p['id'], p['path']) for p in new_pl]
+            if changed:
+                playlist = new_pl
+                touch_state(playlist_changed=True)
+            # mantém a faixa atual se ela continua na biblioteca
+            for i, item in enumerate(playlist):
+                if item['path'] == cur_path:
+                    index = i
+                    break
             # se índice atual for maior que o novo tamanho, ajustar
-            global index
             if index >= len(playlist):
                 index = max(0, len(playlist)-1)
+            # com a playlist nova o touch_state acima já valeu; sem ela, só se a faixa andou
+            if not changed and index != old_index:
+                touch_state()
+        # um rescan dá nova chance a arquivos que falhavam (ex.: ainda não baixados)
+        supervisor.clear_quarantine()
         log(f"scan_playlist: encontrou {len(playlist)} arquivo(s).")
         for item in playlist:
             log(f"  {item['id']}: {item['path']}")
+        if changed:
+            save_playlist_cache(new_pl)
         return len(playlist)
     except Exception as e:
         log(f"Erro ao escanear pasta: {e}")
-        playlist = []
+        with state_lock:
+            playlist = []
+            touch_state(playlist_changed=True)
+        return 0
+
+
+def save_playlist_cache(items):
+    try:
+        tmp = PLAYLIST_CACHE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp, PLAYLIST_CACHE)
+    except Exception as e:
+        log(f"Falha ao salvar índice da playlist: {e}")
+
+
+def load_playlist_cache():
+    """Carrega a playlist salva no último scan. Retorna o número de faixas."""
+    global playlist
+    try:
+        with open(PLAYLIST_CACHE, encoding="utf-8") as f:
+            items = json.load(f)
+        items = [{ 'id': p['id'], 'path': p['path'], 'name': p['name'] } for p in items]
+    except FileNotFoundError:
         return 0
+    except Exception as e:
+        log(f"Índice da playlist ignorado: {e}")
+        return 0
+    with state_lock:
+        if not playlist:
+            playlist = items
+            touch_state(playlist_changed=True)
+    log(f"índice carregado: {len(items)} faixa(s).")
+    return len(items)
+
+
+# tabelas do cabeçalho MP3 (layer III): bitrate em kbps e taxa de amostragem em Hz
+_MP3_BITRATES_V1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_MP3_BITRATES_V2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+_MP3_SAMPLERATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+MP3_MAX_FRAME = 1441  # maior frame layer III possível (320 kbps a 32 kHz, com padding)
+
+
+def mp3_frame_len(buf, i=0, end=None):
+    """Tamanho em bytes do frame MP3 cujo cabeçalho começa em buf[i].
+    Retorna 0 se não houver um cabeçalho layer III válido nessa posição.
+    `end` limita a parte válida de buf (padrão: len(buf))."""
+    if (len(buf) if end is None else end) - i < 4 or buf[i] != 0xFF or (buf[i+1] & 0xE0) != 0xE0:
+        return 0
+    version = (buf[i+1] >> 3) & 3  # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+    layer = (buf[i+1] >> 1) & 3    # 1 = layer III
+    br_idx = buf[i+2] >> 4
+    sr_idx = (buf[i+2] >> 2) & 3
+    if version == 1 or layer != 1 or br_idx in (0, 15) or sr_idx == 3:
+        return 0
+    padding = (buf[i+2] >> 1) & 1
+    samplerate = _MP3_SAMPLERATES[version][sr_idx]
+    if version == 3:
+        return 144000 * _MP3_BITRATES_V1[br_idx] // samplerate + padding
+    return 72000 * _MP3_BITRATES_V2[br_idx] // samplerate + padding
+
+
+def find_mp3_frame(buf, start=0, end=None):
+    """Procura em buf o primeiro início de frame seguido de outro frame válido
+    (dois cabeçalhos seguidos evitam falsos positivos no meio do áudio).
+    Retorna o índice ou -1."""
+    if end is None:
+        end = len(buf)
+    i = start
+    while True:
+        i = buf.find(b"\xff", i, end)
+        if i < 0:
+            return -1
+        n = mp3_frame_len(buf, i, end)
+        if n and mp3_frame_len(buf, i + n, end):
+            return i
+        i += 1
+
+
+class BufferPool:
+    """Buffers pré-alocados reutilizados em rodízio. Um buffer só volta a ser
+    escrito depois de `count` outros; com `count` maior que a fila de um cliente
+    mais um lote de escrita, as memoryviews publicadas continuam válidas enquanto
+    o cliente está em `clients`. Filas descartadas pelo broadcaster são esvaziadas
+    e o gerador do ouvinte abandona o que já tinha tirado delas (ver publish_chunk
+    e stream_generator)."""
+
+    def __init__(self, count, size):
+        self.bufs = [bytearray(size) for _ in range(count)]
+        self.i = 0
+
+    def take(self):
+        buf = self.bufs[self.i]
+        self.i = (self.i + 1) % len(self.bufs)
+        return buf
+
+
+class Mp3FrameAligner:
+    """Lê a saída do ffmpeg com readinto direto em buffers do pool e devolve
+    memoryviews somente leitura com frames MP3 completos. Só o resto incompleto
+    (menos de um frame) é copiado, para o início do buffer seguinte.
+    Cada faixa usa um aligner novo: o resto incompleto da faixa anterior é
+    descartado e a próxima começa num limite de frame, na mesma conexão."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.buf = pool.take()
+        self.fill = 0
+        self.synced = False
+
+    def read_from(self, stream, n):
+        """Lê até n bytes de stream. Retorna (bytes lidos, memoryview dos frames
+        completos ou None); 0 bytes lidos indica fim do stream."""
+        buf = self.buf
+        n = min(n, len(buf) - self.fill)
+        target = memoryview(buf)[self.fill:self.fill+n]
+        # baixa latência: entrega o que o ffmpeg já escreveu, sem esperar n bytes
+        got = stream.readinto1(target) if LOW_LATENCY else stream.readinto(target)
+        if not got:
+            return 0, None
+        fill = self.fill + got
+        start = 0
+        if not self.synced:
+            start = find_mp3_frame(buf, 0, fill)
+            if start < 0:
+                # sem sincronismo: guarda só o final, que pode ter um cabeçalho cortado
+                keep = min(fill, 2 * MP3_MAX_FRAME)
+                buf[:keep] = buf[fill-keep:fill]
+                self.fill = keep
+                return got, None
+            self.synced = True
+        pos = start
+        size = mp3_frame_len(buf, pos, fill)
+        while size and pos + size <= fill:
+            pos += size
+            size = mp3_frame_len(buf, pos, fill)
+        if not size and fill - pos >= 4:
+            self.synced = False  # cabeçalho inválido: ressincroniza na próxima leitura
+        tail = fill - pos
+        if pos == start:
+            buf[:tail] = buf[start:fill]
+            self.fill = tail
+            return got, None
+        out = memoryview(buf)[start:pos].toreadonly()
+        self.buf = self.pool.take()
+        self.buf[:tail] = buf[pos:fill]
+        self.fill = tail
+        return got, out
+
+
+class TimeshiftRing:
+    """Arquivo circular mapeado em memória com os últimos minutos da transmissão.
+    Posições são absolutas (total de bytes já escritos); o arquivo guarda apenas
+    os últimos `size` bytes. Leituras devolvem memoryviews do próprio mmap, então
+    ouvintes atrasados não acumulam áudio em memória."""
+
+    # folga mantida atrás do ponto de escrita para não ler região sendo sobrescrita
+    GUARD = 64 * 1024
+
+    def __init__(self, size, folder=None):
+        # nome exclusivo por processo: outra instância (um teste ao lado da rádio)
+        # não trunca nem reescreve o ring que esta mantém mapeado
+        fd, self.path = tempfile.mkstemp(prefix=f"radio_timeshift_{os.getpid()}_", suffix=".ring", dir=folder)
+        self.size = size
+        self.head = 0
+        self.cond = threading.Condition()
+        self._file = os.fdopen(fd, "r+b")
+        try:
+            self._file.truncate(size)
+            self._mm = mmap.mmap(self._file.fileno(), size)
+        except Exception:
+            self._file.close()
+            os.remove(self.path)
+            raise
+        self._view = memoryview(self._mm).toreadonly()
+
+    def write(self, data):
+        n = len(data)
+        if n > self.size:
+            data = data[n - self.size:]
+        m = len(data)
+        pos = (self.head + n - m) % self.size
+        first = min(m, self.size - pos)
+        self._mm[pos:pos+first] = data[:first]
+        if first < m:
+            self._mm[0:m-first] = data[first:]
+        with self.cond:
+            self.head += n
+            self.cond.notify_all()
+
+    def oldest(self):
+        """Posição mais antiga que ainda pode ser lida com segurança."""
+        return max(0, self.head - self.size + self.GUARD)
+
+    def read(self, pos, max_len):
+        """Memoryview (somente leitura) de até max_len bytes a partir de pos.
+        Retorna None se pos já foi sobrescrito; vazio se pos alcançou o ao vivo."""
+        head = self.head
+        if pos < head - self.size + self.GUARD:
+            return None
+        off = pos % self.size
+        n = min(max_len, head - pos, self.size - off)
+        return self._view[off:off+max(0, n)]
+
+    def wait(self, pos, timeout):
+        """Espera até haver dados além de pos. Retorna True se houver."""
+        with self.cond:
+            if self.head <= pos:
+                self.cond.wait(timeout)
+            return self.head > pos
+
+    def close(self):
+        """Libera o mmap e apaga o arquivo (registrado com atexit)."""
+        try:
+            self._view.release()
+            self._mm.close()
+        except BufferError:
+            pass  # algum ouvinte de timeshift ainda segura uma view; o SO libera na saída
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            log(f"Falha ao apagar {self.path}: {e}")
+
+    def align(self, pos):
+        """Avança pos até o próximo início de frame MP3 (ou até o ao vivo)."""
+        window = 8 * 1024
+        while pos < self.head:
+            n = min(window, self.head - pos)
+            off = pos % self.size
+            if off + n <= self.size:
+                buf = bytes(self._view[off:off+n])
+            else:
+                buf = bytes(self._view[off:]) + bytes(self._view[:off + n - self.size])
+            i = find_mp3_frame(buf)
+            if i >= 0:
+                return pos + i
+            if n < window:
+                break
+            pos += n - 8  # sobreposição para cabeçalhos cortados na borda
+        return self.head
+
+
+def bytes_per_second():
+    return BITRATE_KBPS * 1000 // 8
+
+
+def start_timeshift():
+    global timeshift
+    if timeshift is not None or TIMESHIFT_SECONDS <= 0:
+        return
+    try:
+        timeshift = TimeshiftRing(TIMESHIFT_SECONDS * bytes_per_second(), TIMESHIFT_DIR)
+        atexit.register(timeshift.close)
+        log(f"timeshift: {TIMESHIFT_SECONDS}s em {timeshift.path}")
+    except Exception as e:
+        log(f"Falha ao criar timeshift: {e}")
+
+
+class ArchiveRecorder:
+    """Grava a transmissão em arquivos rotativos (um por ARCHIVE_SEGMENT_SECONDS).
+    Ao lado de cada segmento fica um índice `.idx` com uma linha JSON por faixa:
+    { "offset": bytes desde o início do segmento, "time": ..., "id": ..., "name": ... }.
+    Só é usado pela thread do broadcaster."""
+
+    def __init__(self, folder, segment_seconds):
+        self.folder = folder
+        self.segment_seconds = segment_seconds
+        self.segment = None
+        self.offset = 0
+        self.track = None
+        self._f = None
+        self._idx = None
+
+    def _segment_name(self, now):
+        start = int(now // self.segment_seconds) * self.segment_seconds
+        return time.strftime("radio-%Y%m%d-%H%M%S", time.localtime(start)) + ".mp3"
+
+    def _rotate(self, name):
+        self.close()
+        path = os.path.join(self.folder, name)
+        self._f = open(path, "ab")
+        self._idx = open(path + ".idx", "a", encoding="utf-8")
+        self.segment = name
+        self.offset = self._f.tell()
+        log(f"arquivo: gravando {path}")
+        # a faixa em andamento continua no novo segmento
+        if self.track is not None:
+            self._write_index()
+
+    def _write_index(self):
+        entry = dict(self.track, offset=self.offset, time=time.time())
+        self._idx.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._idx.flush()
+
+    def write(self, data):
+        name = self._segment_name(time.time())
+        if name != self.segment:
+            self._rotate(name)
+        self._f.write(data)
+        self.offset += len(data)
+
+    def track_started(self, item):
+        self.track = { 'id': item['id'], 'name': item['name'] }
+        if self._f is not None:
+            self._f.flush()
+            self._write_index()
+
+    def close(self):
+        for f in (self._f, self._idx):
+            try:
+                if f is not None:
+                    f.close()
+            except Exception:
+                pass
+        self._f = self._idx = None
+        self.segment = None
+
+
+def start_archive():
+    global recorder
+    if recorder is not None or not ARCHIVE_FOLDER:
+        return
+    try:
+        os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+        recorder = ArchiveRecorder(ARCHIVE_FOLDER, ARCHIVE_SEGMENT_SECONDS)
+        log(f"arquivo contínuo em {ARCHIVE_FOLDER}")
+    except Exception as e:
+        log(f"Falha ao iniciar arquivo contínuo: {e}")
+
+
+def offer_latest(q, item):
+    """Fila rasa (baixa latência): se estiver cheia, descarta o chunk mais antigo
+    (frames inteiros, então o stream continua válido) em vez de esperar o ouvinte."""
+    global stream_gaps
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+                stream_gaps += 1
+            except queue.Empty:
+                pass
+
+
+def publish_chunk(chunk):
+    """Distribui um pedaço do áudio codificado para os clientes, o timeshift e o arquivo.
+    As filas dos clientes recebem (instante de saída do encoder, chunk)."""
+    global recorder, published_bytes
+    item = (time.monotonic(), chunk)
+    with publish_lock:
+        targets = list(clients)
+        published_bytes += len(chunk)
+        publish_log.append((published_bytes, time.time()))
+    dead = []
+    for q in targets:
+        try:
+            if LOW_LATENCY:
+                offer_latest(q, item)
+            else:
+                q.put(item, timeout=0.5)
+        except Exception:
+            dead.append(q)
+    for d in dead:
+        clients.discard(d)
+        # os chunks pendentes apontam para buffers do pool que logo serão reescritos
+        while True:
+            try:
+                d.get_nowait()
+            except queue.Empty:
+                break
+    if timeshift is not None:
+        timeshift.write(chunk)
+    if recorder is not None:
+        try:
+            recorder.write(chunk)
+        except Exception as e:
+            log(f"Falha ao gravar arquivo, gravação desativada: {e}")
+            recorder.close()
+            recorder = None
+
+
+def build_icy_block(title):
+    """Bloco de metadados ICY: 1 byte com o tamanho/16 seguido de StreamTitle com padding."""
+    text = "StreamTitle='{}';".format(title.replace("'", "’")).encode("utf-8")[:255 * 16]
+    n = (len(text) + 15) // 16
+    return bytes([n]) + text.ljust(n * 16, b"\0")
+
+
+def on_track_start(item):
+    """Chamado pelo broadcaster sempre que uma faixa começa a ser transmitida."""
+    global icy_block
+    icy_block = build_icy_block(os.path.splitext(item['name'])[0])
+    if recorder is not None:
+        recorder.track_started(item)
+
+
+class EncoderSupervisor:
+    """Dono dos processos ffmpeg do broadcaster.
+    - drena o stderr numa thread, logando no máximo ENCODER_STDERR_LINES_PER_SEC linhas/s;
+    - watchdog: mata o processo se uma leitura ficar ENCODER_WATCHDOG_SECONDS sem saída;
+    - classifica cada fim de processo e aplica backoff entre reinícios;
+    - põe em quarentena arquivos que falham ENCODER_QUARANTINE_AFTER vezes seguidas,
+      por ENCODER_QUARANTINE_SECONDS ou até o próximo rescan (arquivos do OneDrive
+      podem falhar só enquanto não foram baixados).
+    Falhas ao iniciar o processo (ffmpeg ausente, sem permissão) não são culpa do
+    arquivo: entram só num backoff global, sem contar para a quarentena."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.proc = None
+        self.counters = {
+            "spawns": 0, "spawn_errors": 0, "failures": 0, "watchdog_trips": 0,
+            "restarts": 0, "quarantined": 0, "stderr_lines": 0, "stderr_dropped": 0,
+        }
+        self.spawn_ms_last = 0.0
+        self.first_byte_ms_last = 0.0
+        self.fail_counts = {}  # path -> falhas seguidas
+        self.spawn_error_streak = 0  # falhas seguidas de Popen, independentes do arquivo
+        self.quarantine = {}  # path -> monotonic em que a quarentena expira (None = só no rescan)
+        self._spawned_at = None
+        self._read_started = None  # monotonic do início da leitura em andamento
+        self._killed = False
+        self._tripped = False
+        self._watchdog = None
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def spawn(self, path, start_seconds=0):
+        # sem ID3 nem frame Xing: a saída de cada faixa é só uma sequência de frames.
+        # Taxa e canais fixos: as faixas trocam na mesma conexão e o player não
+        # aceita mudança de formato no meio do stream (CHUNK_SIZE do perfil low conta com 44,1 kHz)
+        cmd = [FFMPEG_BIN, "-re", "-i", path, "-vn", "-f", "mp3", "-ab", f"{BITRATE_KBPS}k",
+               "-ar", "44100", "-ac", "2",
+               "-id3v2_version", "0", "-write_xing", "0", "pipe:1", "-loglevel", "error"]
+        if LOW_LATENCY:
+            # grava cada pacote no pipe assim que sai do encoder
+            cmd[-3:-3] = ["-flush_packets", "1"]
+        if start_seconds > 0:
+            cmd[2:2] = ["-ss", f"{start_seconds:.2f}"]
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+            self._watchdog.start()
+        t0 = time.monotonic()
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            self._count("spawn_errors")
+            self.spawn_error_streak += 1
+            log(f"Falha ao iniciar {FFMPEG_BIN}: {e}")
+            return None
+        self.spawn_error_streak = 0
+        self._spawned_at = time.monotonic()
+        self.spawn_ms_last = (self._spawned_at - t0) * 1000
+        self._count("spawns")
+        self._killed = self._tripped = False
+        self.proc = proc
+        threading.Thread(target=self._drain_stderr, args=(proc, os.path.basename(path)), daemon=True).start()
+        return proc
+
+    def read(self, aligner, n):
+        """Lê até n bytes do encoder atual através do aligner (ver Mp3FrameAligner.read_from)."""
+        self._read_started = time.monotonic()
+        try:
+            got, frames = aligner.read_from(self.proc.stdout, n)
+        finally:
+            self._read_started = None
+        if got and self._spawned_at is not None:
+            self.first_byte_ms_last = (time.monotonic() - self._spawned_at) * 1000
+            self._spawned_at = None
+        return got, frames
+
+    def kill(self):
+        """Encerra o processo atual por decisão nossa (skip, parada); não conta como falha."""
+        proc = self.proc
+        if proc is None:
+            return
+        self._killed = True
+        try:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait(timeout=0.2)
+        except Exception:
+            pass
+
+    def finish(self, path, nbytes):
+        """Classifica o fim do processo atual: 'ok', 'retry' ou 'quarantined'."""
+        proc, self.proc = self.proc, None
+        if proc is None:
+            # o processo nem chegou a existir: tenta de novo após o backoff global
+            return "retry"
+        try:
+            rc = proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            rc = proc.wait()
+        if self._killed:
+            return "ok"
+        if not self._tripped and rc == 0 and nbytes > 0:
+            self.fail_counts.pop(path, None)
+            return "ok"
+        self._count("failures")
+        fails = self.fail_counts.get(path, 0) + 1
+        self.fail_counts[path] = fails
+        reason = "watchdog" if self._tripped else f"rc={rc} bytes={nbytes}"
+        log(f"encoder falhou ({reason}) em {os.path.basename(path)}, falha {fails}/{ENCODER_QUARANTINE_AFTER}")
+        if fails >= ENCODER_QUARANTINE_AFTER:
+            with self.lock:
+                self.quarantine[path] = (time.monotonic() + ENCODER_QUARANTINE_SECONDS
+                                         if ENCODER_QUARANTINE_SECONDS > 0 else None)
+            self.fail_counts.pop(path, None)
+            self._count("quarantined")
+            log(f"arquivo em quarentena: {path}")
+            return "quarantined"
+        self._count("restarts")
+        return "retry"
+
+    def is_quarantined(self, path):
+        with self.lock:
+            if path not in self.quarantine:
+                return False
+            expires = self.quarantine[path]
+            if expires is None or time.monotonic() < expires:
+                return True
+            del self.quarantine[path]
+        log(f"quarentena expirou, tentando de novo: {path}")
+        return False
+
+    def clear_quarantine(self):
+        """Libera todos os arquivos em quarentena (chamado a cada rescan)."""
+        with self.lock:
+            n = len(self.quarantine)
+            self.quarantine.clear()
+        if n:
+            log(f"{n} arquivo(s) saíram da quarentena.")
+
+    def backoff(self, path):
+        base, cap = ENCODER_BACKOFF_SECONDS
+        n = max(self.fail_counts.get(path, 1), self.spawn_error_streak)
+        return min(cap, base * 2 ** (n - 1))
+
+    def _drain_stderr(self, proc, name):
+        window = int(time.monotonic())
+        logged = dropped = 0
+        try:
+            for raw in proc.stderr:
+                line = raw.decode("utf-8", "replace").rstrip()
+                if not line:
+                    continue
+                now = int(time.monotonic())
+                if now != window:
+                    if dropped:
+                        log(f"ffmpeg pid={proc.pid} file={name!r}: {dropped} linha(s) suprimida(s)")
+                    window, logged, dropped = now, 0, 0
+                self._count("stderr_lines")
+                if logged < ENCODER_STDERR_LINES_PER_SEC:
+                    logged += 1
+                    log(f"ffmpeg pid={proc.pid} file={name!r}: {line}")
+                else:
+                    dropped += 1
+                    self._count("stderr_dropped")
+        except Exception:
+            pass
+        if dropped:
+            log(f"ffmpeg pid={proc.pid} file={name!r}: {dropped} linha(s) suprimida(s)")
+
+    def _watchdog_loop(self):
+        while True:
+            time.sleep(1)
+            started, proc = self._read_started, self.proc
+            if started is None or proc is None:
+                continue
+            if time.monotonic() - started > ENCODER_WATCHDOG_SECONDS and proc.poll() is None:
+                self._tripped = True
+                self._count("watchdog_trips")
+                log(f"watchdog: ffmpeg pid={proc.pid} sem saída há {ENCODER_WATCHDOG_SECONDS}s, reiniciando")
+                try:
+                    proc.kill()
+                except Exception:
+                    pass
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+        out["spawn_ms_last"] = round(self.spawn_ms_last, 1)
+        out["first_byte_ms_last"] = round(self.first_byte_ms_last, 1)
+        out["spawn_error_streak"] = self.spawn_error_streak
+        with self.lock:
+            out["quarantine"] = sorted(os.path.basename(p) for p in self.quarantine)
+        return out
+
+
+supervisor = EncoderSupervisor()
 
 
 def start_broadcaster():
-    global broadcaster_thread, broadcaster_stop
+    global broadcaster_thread, broadcaster_stop, chunk_pool
     if broadcaster_thread and broadcaster_thread.is_alive():
         return
+    if chunk_pool is None:
+        # folga além da fila de um cliente: views ainda sendo escritas ou agrupadas
+        chunk_pool = BufferPool(CLIENT_QUEUE_SIZE + 64, CHUNK_SIZE + 2 * MP3_MAX_FRAME)
+    start_timeshift()
+    start_archive()
     broadcaster_stop.clear()
     broadcaster_thread = threading.Thread(target=broadcaster_loop, daemon=True)
     broadcaster_thread.start()
@@ -88,7 +794,8 @@ def start_broadcaster():
 def broadcaster_loop():
     global index, paused, loop_mode, action_pending, action_pending_index
     manual_advance = False  # flag para controlar skip manual
-    current_proc = None
+    retry_path, retry_at = None, 0.0  # retomada após falha do encoder
+    quarantined_run = 0  # faixas seguidas puladas por quarentena
 
     while not broadcaster_stop.is_set():
         with state_lock:
@@ -119,98 +826,23 @@ def broadcaster_loop():
                     pass
                 if index >= len(playlist):
                     index = max(0, len(playlist)-1)
+                touch_state(playlist_changed=True)
             continue
 
-        # Garante que não haja outro processo ativo
-        if current_proc is not None:
-            try:
-                if current_proc.poll() is None:
-                    current_proc.kill()
-                    current_proc.wait(timeout=0.2)
-            except Exception:
-                pass
-            current_proc = None
-
-        cmd = [FFMPEG_BIN, "-re", "-i", cur_path, "-vn", "-f", "mp3", "-ab", "192k", "pipe:1", "-loglevel", "error"]
-        log(f"Tocando: {cur_item['id']} - {cur_path}")
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        current_proc = proc
-
-        try:
-            while True:
-                if broadcaster_stop.is_set():
-                    try:
-                        proc.kill()
-                    except Exception:
-                        pass
-                    break
-
-                # skip/prev or jump via endpoint
-                if skip_event.is_set():
-                    with state_lock:
-                        if action_pending == "next":
-                            index = (index + 1) % len(playlist)
-                        elif action_pending == "prev":
-                            index = (index - 1 + len(playlist)) % len(playlist)
-                        elif action_pending == "set_index" and action_pending_index is not None:
-                            # salto direto
-                            if 0 <= action_pending_index < len(playlist):
-                                index = action_pending_index
-                        action_pending = None
-                        action_pending_index = None
-                        manual_advance = True
-                    # mata o processo atual e espera ele terminar
-                    try:
-                        proc.kill()
-                    except Exception:
-                        pass
-                    try:
-                        proc.wait(timeout=0.2)
-                    except Exception:
-                        pass
-
-                    # limpa os buffers das filas dos clientes para evitar sobreposição de áudio
-                    for q in list(clients):
-                        try:
-                            while True:
-                                q.get_nowait()
-                        except Exception:
-                            pass
-
-                    skip_event.clear()
-                    current_proc = None
-                    break
-
-                chunk = proc.stdout.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-
-                # distribuir para clientes
-                dead = []
-                for q in list(clients):
-                    try:
-                        q.put(chunk, timeout=0.5)
-                    except Exception:
-                        dead.append(q)
-                for d in dead:
-                    clients.discard(d)
-
-                # pausa: não mata o processo, apenas espera antes de enviar chunks
-                while paused and not broadcaster_stop.is_set() and not skip_event.is_set():
-                    time.sleep(0.05)
-
-        finally:
-            # garante que o processo foi finalizado
-            try:
-                if proc and proc.poll() is None:
-                    proc.kill()
-            except Exception:
-                pass
-            try:
-                proc.wait(timeout=0.2)
-            except Exception:
-                pass
-            current_proc = None
+        if supervisor.is_quarantined(cur_path):
+            outcome = "quarantined"
+        else:
+            outcome = play_item(cur_item, retry_at if retry_path == cur_path else 0.0)
+        if isinstance(outcome, tuple):
+            # reinicia a mesma faixa de onde parou, após o backoff
+            retry_at = (retry_at if retry_path == cur_path else 0.0) + outcome[1]
+            retry_path = cur_path
+            broadcaster_stop.wait(supervisor.backoff(cur_path))
+            continue
+        retry_path, retry_at = None, 0.0
+        quarantined_run = quarantined_run + 1 if outcome == "quarantined" else 0
+        if outcome == "skipped":
+            manual_advance = True
 
         # próxima faixa segundo loop_mode
         with state_lock:
@@ -221,25 +853,290 @@ def broadcaster_loop():
                 manual_advance = False
                 continue
 
-            if loop_mode == "one":
+            # uma volta inteira sem nada tocável: pausa em vez de girar pela playlist
+            if quarantined_run >= len(playlist):
+                quarantined_run = 0
+                paused = True
+                touch_state()
+                log("nenhuma faixa tocável (todas em quarentena); pausando.")
+                continue
+
+            if loop_mode == "one" and outcome != "quarantined":
                 pass
-            elif loop_mode == "all":
+            elif loop_mode in ("all", "one"):
                 index = (index + 1) % len(playlist)
             else:
                 if index + 1 < len(playlist):
                     index += 1
                 else:
                     paused = True
+            touch_state()
         time.sleep(0.05)
 
 
-def stream_generator(client_q):
+def play_item(cur_item, start_seconds):
+    """Transmite uma faixa através do supervisor. Retorna 'ended', 'skipped',
+    'quarantined' ou ('retry', segundos transmitidos nesta tentativa)."""
+    global index, action_pending, action_pending_index, stream_gaps
+    cur_path = cur_item['path']
+    if start_seconds:
+        log(f"Retomando: {cur_item['id']} - {cur_path} em {start_seconds:.1f}s")
+    else:
+        log(f"Tocando: {cur_item['id']} - {cur_path}")
+    proc = supervisor.spawn(cur_path, start_seconds)
+    if proc is not None and not start_seconds:
+        on_track_start(cur_item)
+
+    sent = 0
+    skipped = False
+    aligner = Mp3FrameAligner(chunk_pool)
+    try:
+        while proc is not None:
+            if broadcaster_stop.is_set():
+                supervisor.kill()
+                break
+
+            # skip/prev or jump via endpoint
+            if skip_event.is_set():
+                with state_lock:
+                    if action_pending == "next":
+                        index = (index + 1) % len(playlist)
+                    elif action_pending == "prev":
+                        index = (index - 1 + len(playlist)) % len(playlist)
+                    elif action_pending == "set_index" and action_pending_index is not None:
+                        # salto direto
+                        if 0 <= action_pending_index < len(playlist):
+                            index = action_pending_index
+                    action_pending = None
+                    action_pending_index = None
+                    skipped = True
+                    touch_state()
+                # mata o processo atual e espera ele terminar
+                supervisor.kill()
+
+                # limpa os buffers das filas dos clientes para evitar sobreposição de áudio
+                for q in list(clients):
+                    try:
+                        q.get_nowait()
+                        stream_gaps += 1
+                        while True:
+                            q.get_nowait()
+                    except Exception:
+                        pass
+
+                skip_event.clear()
+                break
+
+            got, frames = supervisor.read(aligner, CHUNK_SIZE)
+            if not got:
+                break
+            sent += got
+
+            # distribuir para clientes, sempre em frames inteiros; a mesma
+            # memoryview (sem cópia) vai para todas as filas
+            if frames is not None:
+                publish_chunk(frames)
+
+            # pausa: não mata o processo, apenas espera antes de enviar chunks
+            while paused and not broadcaster_stop.is_set() and not skip_event.is_set():
+                time.sleep(0.05)
+
+    finally:
+        # garante que o processo foi finalizado e classifica o resultado
+        outcome = supervisor.finish(cur_path, sent)
+
+    if skipped:
+        return "skipped"
+    if outcome == "retry":
+        return ("retry", sent / bytes_per_second())
+    return outcome if outcome == "quarantined" else "ended"
+
+
+class Admission:
+    """Contadores de ouvintes para o controle de admissão do /stream.
+    Tem lock próprio e só faz operações O(1), sem tocar no state_lock,
+    para não atrasar o broadcaster nem quem já está ouvindo."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.per_ip = {}
+        self.admitted = 0
+        self.rejected = {}
+
+    def try_admit(self, ip):
+        """Reserva uma vaga para ip. Retorna None se admitido ou o motivo da recusa."""
+        with self.lock:
+            n_ip = self.per_ip.get(ip, 0)
+            if MAX_LISTENERS and self.total >= MAX_LISTENERS:
+                reason = "listeners"
+            elif MAX_LISTENERS_PER_IP and n_ip >= MAX_LISTENERS_PER_IP:
+                reason = "per_ip"
+            elif MAX_EGRESS_KBPS and (self.total + 1) * BITRATE_KBPS > MAX_EGRESS_KBPS:
+                reason = "bandwidth"
+            else:
+                self.total += 1
+                self.per_ip[ip] = n_ip + 1
+                self.admitted += 1
+                return None
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+            return reason
+
+    def release(self, ip):
+        with self.lock:
+            self.total = max(0, self.total - 1)
+            n_ip = self.per_ip.get(ip, 0) - 1
+            if n_ip > 0:
+                self.per_ip[ip] = n_ip
+            else:
+                self.per_ip.pop(ip, None)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "listeners": self.total,
+                "addresses": len(self.per_ip),
+                "egress_kbps": self.total * BITRATE_KBPS,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+
+admission = Admission()
+
+
+def refuse_listener(reason):
+    log(f"ouvinte recusado ({reason}).")
+    if OVERFLOW_REDIRECT_URL and reason != "per_ip":
+        return redirect(OVERFLOW_REDIRECT_URL, code=307)
+    resp = jsonify({"error": "Capacidade esgotada", "reason": reason})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return resp
+
+
+def admitted_response(gen, ip, client_q=None, headers=None):
+    """Response de streaming que devolve a vaga de admissão quando a conexão fecha
+    (mesmo que o gerador nunca tenha começado a rodar)."""
+    released = []
+
+    def on_close():
+        if released:
+            return
+        released.append(True)
+        admission.release(ip)
+        if client_q is not None:
+            clients.discard(client_q)
+
+    resp = Response(gen, mimetype='audio/mpeg', headers=headers)
+    resp.call_on_close(on_close)
+    return resp
+
+
+def note_first_listener_byte():
+    global first_listener_byte_ms
+    if first_listener_byte_ms is None:
+        first_listener_byte_ms = (time.monotonic() - STARTED_AT) * 1000
+        log(f"primeiro byte entregue a um ouvinte {first_listener_byte_ms:.0f} ms após o início.")
+
+
+class IcyState:
+    """Posição de um ouvinte ICY: bytes de áudio até o próximo bloco e o último bloco enviado."""
+    __slots__ = ("remaining", "last")
+
+    def __init__(self):
+        self.remaining = ICY_METAINT
+        self.last = None
+
+
+def icy_parts(chunk, icy, parts):
+    """Acrescenta chunk a parts intercalando, a cada ICY_METAINT bytes de áudio, o
+    bloco da faixa atual (ou um bloco vazio se o ouvinte já recebeu esse título)."""
+    mv = memoryview(chunk)
+    n = len(mv)
+    pos = 0
+    while n - pos >= icy.remaining:
+        parts.append(mv[pos:pos+icy.remaining])
+        pos += icy.remaining
+        block = icy_block
+        parts.append(block if block is not icy.last else b"\0")
+        icy.last = block
+        icy.remaining = ICY_METAINT
+    if pos < n:
+        parts.append(mv[pos:])
+        icy.remaining -= n - pos
+
+
+class LatencyStats:
+    """Amostras recentes do atraso entre a saída do encoder e a escrita para o ouvinte."""
+
+    def __init__(self, size=2048):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            data = sorted(self.samples)
+        if not data:
+            return { "samples": 0 }
+        pick = lambda q: round(data[min(len(data) - 1, int(q * len(data)))] * 1000, 1)
+        return { "samples": len(data), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(data[-1] * 1000, 1) }
+
+
+delivery_latency = LatencyStats()
+
+
+def take_batch(client_q, first, icy=None):
+    """Junta a first os chunks já pendentes na fila (e os que chegarem em até
+    WRITE_COALESCE_SECONDS), até WRITE_BATCH_BYTES, para uma única escrita.
+    Com icy (IcyState), os blocos de metadados entram na mesma escrita.
+    Retorna (bytes, instante de saída do encoder do chunk mais antigo)."""
+    stamp, first = first
+    batch = [first]
+    size = len(first)
+    deadline = time.monotonic() + WRITE_COALESCE_SECONDS
+    while size < WRITE_BATCH_BYTES:
+        try:
+            wait = deadline - time.monotonic()
+            _, chunk = client_q.get(timeout=wait) if wait > 0 else client_q.get_nowait()
+        except queue.Empty:
+            break
+        batch.append(chunk)
+        size += len(chunk)
+    if icy is not None:
+        parts = []
+        for chunk in batch:
+            icy_parts(chunk, icy, parts)
+        batch = parts
+    # o WSGI exige bytes: esta é a única cópia do chunk no caminho até o ouvinte,
+    # feita uma vez por escrita e não por chunk
+    return b"".join(batch), stamp
+
+
+def stream_generator(client_q, icy=None):
     try:
         while True:
             try:
-                chunk = client_q.get(timeout=2)
-                yield chunk
+                item = client_q.get(timeout=2)
+                # fila descartada: os chunks dela podem estar em buffers já reutilizados
+                if client_q not in clients:
+                    return
+                data, stamp = take_batch(client_q, item, icy)
+                if client_q not in clients:
+                    return
+                yield data
+                # o servidor só pede o próximo item depois de escrever este
+                delivery_latency.add(time.monotonic() - stamp)
+                if first_listener_byte_ms is None:
+                    note_first_listener_byte()
             except queue.Empty:
+                # o broadcaster descarta filas de clientes que não acompanham
+                if client_q not in clients:
+                    return
                 continue
     finally:
         try:
@@ -249,14 +1146,73 @@ def stream_generator(client_q):
         print(f"[radio] cliente desconectado. clientes atuais: {len(clients)}", flush=True)
 
 
+def timeshift_generator(pos):
+    """Entrega o áudio do ring a partir de pos, sem passar à frente do ritmo
+    de reprodução mais que TIMESHIFT_BURST_SECONDS."""
+    rate = bytes_per_second()
+    started = time.monotonic()
+    sent = 0
+    try:
+        while True:
+            view = timeshift.read(pos, 16 * CHUNK_SIZE)
+            if view is None:
+                # ficou para trás mais que o tamanho do ring: volta ao mais antigo
+                pos = timeshift.align(timeshift.oldest())
+                continue
+            if not len(view):
+                timeshift.wait(pos, 2)
+                continue
+            ahead = sent - rate * (time.monotonic() - started) - rate * TIMESHIFT_BURST_SECONDS
+            if ahead > 0:
+                time.sleep(ahead / rate)
+            n = len(view)
+            yield bytes(view)  # o WSGI exige bytes; uma cópia por bloco de 16 KB
+            if first_listener_byte_ms is None:
+                note_first_listener_byte()
+            pos += n
+            sent += n
+    finally:
+        log("ouvinte de timeshift desconectado.")
+
+
 @app.route("/stream")
 def stream():
-    q = queue.Queue(maxsize=512)
-    clients.add(q)
+    offset = request.args.get("offset", type=int)
+    timeshifted = offset is not None and offset < 0
+    if timeshifted and timeshift is None and TIMESHIFT_SECONDS <= 0:
+        return jsonify({"error": "timeshift desativado"}), 404
+
+    ip = request.remote_addr
+    reason = admission.try_admit(ip)
+    if reason:
+        return refuse_listener(reason)
+
+    if timeshifted:
+        start_broadcaster()
+        if timeshift is None:
+            admission.release(ip)
+            return jsonify({"error": "timeshift indisponível"}), 503
+        pos = max(timeshift.oldest(), timeshift.head + offset * bytes_per_second())
+        log(f"ouvinte de timeshift conectado ({offset}s).")
+        return admitted_response(timeshift_generator(timeshift.align(pos)), ip)
+
+    icy = None
+    headers = {}
+    if request.headers.get("Icy-MetaData", "").strip() == "1":
+        icy = IcyState()
+        headers.update({ "icy-metaint": str(ICY_METAINT), "icy-name": ICY_NAME, "icy-br": str(BITRATE_KBPS) })
+
+    q = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    # offset do ao vivo na conexão: com /latency?offset=, um cliente de teste
+    # calcula o atraso de ponta a ponta de cada byte recebido. Lido junto com a
+    # entrada em clients, o primeiro chunk da fila começa exatamente nele.
+    with publish_lock:
+        headers["X-Stream-Offset"] = str(published_bytes)
+        clients.add(q)
     print(f"[radio] cliente conectado. clientes atuais: {len(clients)}", flush=True)
     start_broadcaster()
     try:
-        return Response(stream_generator(q), mimetype='audio/mpeg')
+        return admitted_response(stream_generator(q, icy), ip, q, headers)
     finally:
         print(f"[radio] stream endpoint returning (client disconnected?)", flush=True)
 
@@ -268,6 +1224,7 @@ def play():
         if not playlist:
             return jsonify({"error":"Playlist vazia"}), 400
         paused = False
+        touch_state()
     start_broadcaster()
     return jsonify({"status":"playing"})
 
@@ -277,6 +1234,7 @@ def pause():
     global paused
     with state_lock:
         paused = True
+        touch_state()
     return jsonify({"status":"paused"})
 
 
@@ -289,6 +1247,7 @@ def nxt():
         action_pending = "next"
         skip_event.set()
         paused = False
+        touch_state()
     return jsonify({"status":"skipped", "action":"next"})
 
 
@@ -301,6 +1260,7 @@ def prev():
         action_pending = "prev"
         skip_event.set()
         paused = False
+        touch_state()
     return jsonify({"status":"previous", "action":"prev"})
 
 
@@ -328,6 +1288,7 @@ def select_by_id():
         action_pending_index = found_idx
         skip_event.set()
         paused = False
+        touch_state()
 
     return jsonify({"status": "ok", "selected": playlist[found_idx]['id']})
 
@@ -341,22 +1302,182 @@ def set_loop():
         return jsonify({"error":"mode deve ser 'none','one' ou 'all'"}), 400
     with state_lock:
         loop_mode = mode
+        touch_state()
     return jsonify({"loop": loop_mode})
 
 
+response_cache = {}  # (rota, formato, compressão) -> (versão, corpo, Content-Encoding, nº de campos voláteis, compressor)
+response_cache_lock = threading.Lock()
+
+
+def negotiate_encoding(offered=("br", "gzip")):
+    """Formato (json/msgpack) e compressão (entre offered, ou None) pedidos pelo cliente."""
+    fmt = "json"
+    if msgpack is not None:
+        # respeita q-values; em empate (ex.: */*) fica o JSON, que vem primeiro
+        best = request.accept_mimetypes.best_match(
+            ["application/json", "application/msgpack", "application/x-msgpack"])
+        if request.args.get("format") == "msgpack" or best in ("application/msgpack", "application/x-msgpack"):
+            fmt = "msgpack"
+    offered = [e for e in offered if e != "br" or brotli is not None]
+    # best_match ignora codificações com q=0 e prefere a primeira oferecida em empate
+    enc = request.accept_encodings.best_match(offered)
+    return fmt, enc
+
+
+def _msgpack_map_header(n):
+    if n < 16:
+        return bytes([0x80 | n])
+    if n < 65536:
+        return b"\xde" + n.to_bytes(2, "big")
+    return b"\xdf" + n.to_bytes(4, "big")
+
+
+def _serialize(obj, fmt):
+    if fmt == "msgpack":
+        return msgpack.packb(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dict_pairs(obj, fmt):
+    """Os pares chave/valor de um dict serializado, sem as chaves (JSON) ou o cabeçalho (msgpack)."""
+    body = _serialize(obj, fmt)
+    if fmt == "msgpack":
+        return body[len(_msgpack_map_header(len(obj))):]
+    return body[1:-1]
+
+
+def cached_response(key, version, build, volatile=None):
+    """Resposta serializada e comprimida uma vez e reaproveitada enquanto `version`
+    (tupla) não mudar. build() monta o objeto e só roda quando o cache não serve.
+    Com volatile (dict pequeno, montado a cada requisição), build() devolve um dict
+    não vazio e os campos de volatile entram no fim dele sem reserializar nem
+    recomprimir a parte em cache: o gzip continua de uma cópia do compressor
+    guardado. Como um stream brotli não pode ser continuado, esse caso só oferece gzip."""
+    fmt, enc = negotiate_encoding(("br", "gzip") if volatile is None else ("gzip",))
+    ck = (key, fmt, enc)
+    nvol = len(volatile) if volatile is not None else None
+    with response_cache_lock:
+        hit = response_cache.get(ck)
+    if hit is None or hit[0] != version or hit[3] != nvol:
+        obj = build()
+        compressor = None
+        if volatile is None:
+            body = _serialize(obj, fmt)
+        elif fmt == "msgpack":
+            body = _msgpack_map_header(len(obj) + nvol) + _dict_pairs(obj, fmt)
+        else:
+            body = b"{" + _dict_pairs(obj, fmt)
+        used = enc if len(body) >= COMPRESS_MIN_BYTES else None
+        if used == "br":
+            body = brotli.compress(body, quality=5)
+        elif used == "gzip" and volatile is not None:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = formato gzip
+            body = compressor.compress(body)
+        elif used == "gzip":
+            body = gzip.compress(body, 6)
+        hit = (version, body, used, nvol, compressor)
+        with response_cache_lock:
+            if len(response_cache) > 512:
+                response_cache.clear()
+            response_cache[ck] = hit
+    body, tag = hit[1], "-".join(str(p) for p in (*key, fmt, enc or "identity", *version))
+    if volatile is not None:
+        tail = _dict_pairs(volatile, fmt)
+        if fmt == "json":
+            tail = b"," + tail + b"}"
+        if hit[4] is not None:
+            c = hit[4].copy()
+            body = body + c.compress(tail) + c.flush()
+        else:
+            body = body + tail
+        tag += f"-{zlib.crc32(tail):08x}"
+    resp = Response(body, mimetype="application/msgpack" if fmt == "msgpack" else "application/json")
+    if hit[2]:
+        resp.headers["Content-Encoding"] = hit[2]
+    resp.headers["Vary"] = "Accept, Accept-Encoding"
+    resp.set_etag(tag)
+    return resp.make_conditional(request)
+
+
 @app.route("/status")
 def status():
+    """Estado atual. Com ?playlist=0 a playlist completa é omitida
+    (o frontend busca páginas em /playlist conforme a rolagem).
+    A parte da playlist fica em cache por playlist_version; índice, pausa, loop
+    e ouvintes são acrescentados a cada requisição."""
+    with_playlist = request.args.get("playlist", "1") != "0"
+
+    def build():
+        with state_lock:
+            info = { "total": len(playlist), "playlist_version": playlist_version }
+            if with_playlist:
+                # playlist como lista de objetos {id,name}
+                info["playlist"] = [{ 'id': p['id'], 'name': p['name'] } for p in playlist]
+        return info
+
     with state_lock:
+        version = playlist_version
         cur = playlist[index] if playlist else None
-        info = {
-            # playlist como lista de objetos {id,name}
-            "playlist": [{ 'id': p['id'], 'name': p['name'] } for p in playlist],
+        volatile = {
             "index": index,
             "current": { 'id': cur['id'], 'name': cur['name'] } if cur else None,
             "paused": paused,
             "loop": loop_mode,
-            "clients": len(clients)
+            "clients": len(clients),
         }
+    return cached_response(("status", with_playlist), (version,), build, volatile)
+
+
+@app.route("/playlist")
+def playlist_page():
+    """Uma página da playlist: /playlist?offset=0&limit=200."""
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = min(500, max(1, request.args.get("limit", 200, type=int)))
+
+    def build():
+        with state_lock:
+            items = [{ 'id': p['id'], 'name': p['name'] } for p in playlist[offset:offset+limit]]
+            return { "version": playlist_version, "total": len(playlist), "offset": offset, "items": items }
+
+    return cached_response(("playlist", offset, limit), (playlist_version,), build)
+
+
+@app.route("/stats")
+def stats():
+    """Contadores operacionais (admissão de ouvintes etc.)."""
+    return jsonify({
+        "admission": admission.snapshot(),
+        "encoder": supervisor.snapshot(),
+        "startup": {
+            "uptime_s": round(time.monotonic() - STARTED_AT, 1),
+            "first_listener_byte_ms": round(first_listener_byte_ms, 1) if first_listener_byte_ms is not None else None,
+        },
+    })
+
+
+@app.route("/latency")
+def latency():
+    """Medição de latência. `delivery` é o atraso entre a saída do encoder e a escrita
+    para o ouvinte. Com ?offset=N (X-Stream-Offset + bytes recebidos, sem ICY),
+    `offset_time` é o time.time() em que o byte N saiu do encoder.
+    Esse mapeamento só vale enquanto nenhum chunk for descartado da fila da conexão:
+    um skip esvazia as filas e o perfil low descarta o chunk mais antigo de uma fila
+    cheia. `stream_gaps` conta esses descartes; se mudou durante a medição, ela
+    deve ser refeita com uma conexão nova."""
+    info = {
+        "profile": LATENCY_PROFILE,
+        "server_time": time.time(),
+        "published_bytes": published_bytes,
+        "stream_gaps": stream_gaps,
+        "delivery": delivery_latency.snapshot(),
+    }
+    offset = request.args.get("offset", type=int)
+    if offset is not None:
+        # o byte N está no primeiro chunk cujo offset final passa de N
+        log_copy = list(publish_log)
+        i = bisect.bisect_right(log_copy, (offset, float("inf")))
+        info["offset_time"] = log_copy[i][1] if i < len(log_copy) else None
     return jsonify(info)
 
 
@@ -406,10 +1527,12 @@ INDEX_HTML = """
     /* playlist abaixo */
     .playlist-panel{display:flex;gap:12px;align-items:flex-start}
     .card-panel{background:linear-gradient(180deg, rgba(255,255,255,0.02), transparent);padding:12px;border-radius:12px;border:1px solid rgba(255,255,255,0.03);width:100%}
-    #pl{list-style:none;margin:0;padding:8px;max-height:360px;overflow:auto}
-    #pl li{padding:10px;border-radius:8px;margin-bottom:6px;background:transparent;border:1px solid rgba(255,255,255,0.02);display:flex;justify-content:space-between;align-items:center;cursor:pointer}
-    #pl li:hover{background:rgba(255,255,255,0.02)}
-    #pl li.active{background:linear-gradient(90deg, rgba(102,255,203,0.06), rgba(96,165,250,0.04));border:1px solid rgba(110,231,183,0.12)}
+    /* playlist virtualizada: só as linhas visíveis existem no DOM, posicionadas pelo índice */
+    #pl{position:relative;margin:0;padding:0;height:360px;overflow:auto}
+    #plSpacer{width:1px}
+    #pl .row{position:absolute;left:8px;right:8px;height:40px;padding:0 10px;border-radius:8px;background:transparent;border:1px solid rgba(255,255,255,0.02);display:flex;align-items:center;cursor:pointer}
+    #pl .row:hover{background:rgba(255,255,255,0.02)}
+    #pl .row.active{background:linear-gradient(90deg, rgba(102,255,203,0.06), rgba(96,165,250,0.04));border:1px solid rgba(110,231,183,0.12)}
     .id{font-family:monospace;color:var(--accent-2);margin-right:8px}
     .fname{flex:1;color:#d7e6f6;overflow:hidden;text-overflow:ellipsis;white-space:nowrap}
 
@@ -455,7 +1578,7 @@ INDEX_HTML = """
         <div class="playlist-panel">
           <div class="card-panel">
             <h3 style="margin:0 0 8px 0;color:#eaf6f0">Playlist</h3>
-            <ul id="pl" aria-label="Playlist"></ul>
+            <div id="pl" role="list" aria-label="Playlist"><div id="plSpacer"></div></div>
             <div class="meta-row"><div>Clientes conectados: <span id="clientsCount">0</span></div><div><button id="btnScrollToCurrent" class="btn small">Ir para atual</button></div></div>
           </div>
         </div>
@@ -467,11 +1590,15 @@ INDEX_HTML = """
   </div>
 
 <script>
-  // novo comportamento: playlist clicável — cada item seleciona a música correspondente
-  let lastStatus = { playlist: [], index: 0, paused: true, loop: 'none' };
+  // playlist clicável e virtualizada: só as linhas visíveis existem no DOM e as
+  // páginas vêm de /playlist conforme a rolagem
+  let lastStatus = { index: 0, current: null, paused: true, loop: 'none', total: 0 };
   let player = null;
   let suppressRefreshUntil = 0;
 
+  const ROW_H = 46, PAD = 8, OVERSCAN = 6, PAGE = 200;
+  const plState = { version: -1, total: 0, pages: new Map(), pending: new Set(), rows: new Map(), pool: [], active: -1 };
+
   function showLoader(id, show){
     const el = document.getElementById(id);
     if(!el) return;
@@ -496,28 +1623,54 @@ INDEX_HTML = """
     }
   }
 
+  // reconecta ao /stream (só quando a conexão atual terminou ou falhou)
+  function reconnectStream(){
+    if(retryTimer){ clearTimeout(retryTimer); retryTimer = null; }
+    player.src = '/stream?t=' + Date.now();
+    player.load();
+    player.play().catch(()=>{});
+  }
+
+  // o <audio> não mostra o status da resposta: recusa (503 + Retry-After) e queda
+  // de rede parecem iguais. Cada falha seguida dobra a espera, até o Retry-After
+  // do servidor, com jitter para que ouvintes recusados não voltem todos juntos.
+  const RETRY_AFTER_MS = {{ retry_after }} * 1000;
+  let retryDelay = 0, retryTimer = null;
+  function scheduleReconnect(){
+    if(retryTimer) return;
+    retryDelay = retryDelay ? Math.min(retryDelay * 2, Math.max(RETRY_AFTER_MS, 500)) : 500;
+    const wait = retryDelay * (0.75 + Math.random() * 0.5);
+    retryTimer = setTimeout(()=>{ retryTimer = null; reconnectStream(); }, wait);
+  }
+
+  // a troca de faixa acontece no servidor, na mesma conexão: aqui só garante
+  // que o player está tocando, sem abrir um novo /stream
+  function ensureStream(){
+    if(!player) player = document.getElementById('player');
+    if(player.error || player.ended || player.networkState === HTMLMediaElement.NETWORK_NO_SOURCE){
+      reconnectStream();
+    } else {
+      player.play().catch(()=>{});
+    }
+  }
+
   async function doControl(path){
     if(!player) player = document.getElementById('player');
+    const total = plState.total;
     if (path === '/play'){
       lastStatus.paused = false; renderFromLastStatus(); await doControlWithLoader('/play','loaderPlay');
-      try{ player.play().catch(()=>{}); }catch(e){}
+      ensureStream();
     } else if (path === '/pause'){
       lastStatus.paused = true; renderFromLastStatus(); await doControlWithLoader('/pause','loaderPause');
       try{ player.pause(); }catch(e){}
     } else if (path === '/next'){
-      if(lastStatus.playlist.length>0) lastStatus.index = (lastStatus.index+1)%lastStatus.playlist.length;
+      if(total>0) setOptimisticIndex((lastStatus.index+1)%total);
       renderFromLastStatus(); await doControlWithLoader('/next','loaderNext');
-      try{ player.play().catch(()=>{}); }catch(e){}
+      ensureStream();
     } else if (path === '/prev'){
-      if(lastStatus.playlist.length>0) lastStatus.index = (lastStatus.index-1+lastStatus.playlist.length)%lastStatus.playlist.length;
+      if(total>0) setOptimisticIndex((lastStatus.index-1+total)%total);
       renderFromLastStatus(); await doControlWithLoader('/prev','loaderPrev');
-      try{ player.play().catch(()=>{}); }catch(e){}
-    }
-    if (player) {
-        const currentSrc = '/stream?t=' + Date.now();
-        player.src = currentSrc;
-        player.load();
-        player.play().catch(()=>{});
+      ensureStream();
     }
   }
 
@@ -537,33 +1690,120 @@ INDEX_HTML = """
     await refreshStatus();
   }
 
-  function renderFromLastStatus(){
+  // ---- playlist virtualizada ----
+  function itemAt(i){
+    const page = plState.pages.get(Math.floor(i / PAGE));
+    if(!page){ fetchPage(Math.floor(i / PAGE)); return null; }
+    return page[i % PAGE] || null;
+  }
+
+  async function fetchPage(n){
+    if(plState.pending.has(n)) return;
+    const version = plState.version;
+    plState.pending.add(n);
+    try{
+      const r = await fetch('/playlist?offset=' + (n * PAGE) + '&limit=' + PAGE);
+      if(!r.ok) return;
+      const j = await r.json();
+      if(j.version !== version){ resetPlaylist(j.version, j.total); return; }
+      plState.pages.set(n, j.items || []);
+      // preenche as linhas visíveis que estavam esperando esta página
+      for(const [i, row] of plState.rows){
+        if(Math.floor(i / PAGE) === n) fillRow(row, i);
+      }
+    }catch(e){ console.warn('Erro ao buscar página da playlist', e); }
+    finally{ plState.pending.delete(n); }
+  }
+
+  function resetPlaylist(version, total){
+    if(version === plState.version && total === plState.total) return;
+    plState.version = version;
+    plState.total = total;
+    plState.pages.clear();
+    plState.pending.clear();
+    for(const row of plState.rows.values()){ row.style.display = 'none'; plState.pool.push(row); }
+    plState.rows.clear();
+    document.getElementById('plSpacer').style.height = (total * ROW_H + PAD * 2) + 'px';
+    renderWindow();
+  }
+
+  function fillRow(row, i){
+    const item = itemAt(i);
+    row.dataset.index = i;
+    row.dataset.id = item ? item.id : '';
+    row.style.top = (PAD + i * ROW_H) + 'px';
+    row.style.display = '';
+    row.firstChild.textContent = item ? item.id : '···';
+    row.lastChild.textContent = item ? item.name : '';
+    row.classList.toggle('active', i === plState.active);
+  }
+
+  function makeRow(){
+    const row = document.createElement('div');
+    row.className = 'row';
+    row.setAttribute('role', 'button');
+    const id = document.createElement('span'); id.className = 'id';
+    const name = document.createElement('span'); name.className = 'fname';
+    row.appendChild(id); row.appendChild(name);
+    document.getElementById('pl').appendChild(row);
+    return row;
+  }
+
+  // cria/recicla apenas as linhas dentro da janela visível (+ OVERSCAN)
+  function renderWindow(){
     const pl = document.getElementById('pl');
-    pl.innerHTML = '';
-    lastStatus.playlist.forEach((p,i)=> {
-      const li = document.createElement('li');
-      li.setAttribute('data-id', p.id);
-      li.setAttribute('role','button');
-      li.innerHTML = `<span style="display:flex;align-items:center"><span class=\"id\">${p.id}</span><span class=\"fname\">${p.name}</span></span>`;
-      li.addEventListener('click', ()=> selectTrack(p.id, i, li));
-      if (i===lastStatus.index) li.classList.add('active');
-      pl.appendChild(li);
-    });
+    const first = Math.max(0, Math.floor((pl.scrollTop - PAD) / ROW_H) - OVERSCAN);
+    const last = Math.min(plState.total, Math.ceil((pl.scrollTop + pl.clientHeight) / ROW_H) + OVERSCAN);
+    for(const [i, row] of plState.rows){
+      if(i < first || i >= last){ plState.rows.delete(i); row.style.display = 'none'; plState.pool.push(row); }
+    }
+    for(let i = first; i < last; i++){
+      if(plState.rows.has(i)) continue;
+      const row = plState.pool.pop() || makeRow();
+      plState.rows.set(i, row);
+      fillRow(row, i);
+    }
+  }
+
+  // troca de faixa: só as duas linhas envolvidas mudam
+  function setActive(i){
+    if(i === plState.active) return;
+    const old = plState.rows.get(plState.active);
+    if(old) old.classList.remove('active');
+    plState.active = i;
+    const cur = plState.rows.get(i);
+    if(cur) cur.classList.add('active');
+  }
+
+  function setOptimisticIndex(i){
+    lastStatus.index = i;
+    const item = plState.pages.has(Math.floor(i / PAGE)) ? itemAt(i) : null;
+    lastStatus.current = item;
+  }
+
+  function scrollToIndex(i, smooth){
+    const pl = document.getElementById('pl');
+    pl.scrollTo({ top: Math.max(0, PAD + i * ROW_H - pl.clientHeight / 2 + ROW_H / 2), behavior: smooth ? 'smooth' : 'auto' });
+  }
+
+  function renderFromLastStatus(){
+    setActive(lastStatus.index);
 
     const statusEl = document.getElementById('statusText');
-    statusEl.innerText = (lastStatus.paused ? '⏸️ Pausado' : '▶️ Tocando') + ' | Loop: ' + (lastStatus.loop || 'none') + ' | Faixa: ' + (lastStatus.playlist[lastStatus.index] ? lastStatus.playlist[lastStatus.index].name : '—');
+    statusEl.innerText = (lastStatus.paused ? '⏸️ Pausado' : '▶️ Tocando') + ' | Loop: ' + (lastStatus.loop || 'none') + ' | Faixa: ' + (lastStatus.current ? lastStatus.current.name : '—');
 
     document.getElementById('clientsCount').innerText = (lastStatus.clients || 0);
   }
 
   async function refreshStatus(){
     try{
-      const r = await fetch('/status'); if(!r.ok) return;
+      const r = await fetch('/status?playlist=0'); if(!r.ok) return;
       const j = await r.json();
       const now = Date.now();
-      lastStatus.playlist = j.playlist || [];
+      resetPlaylist(j.playlist_version, j.total || 0);
       if (now >= suppressRefreshUntil){
         lastStatus.index = (typeof j.index === 'number') ? j.index : 0;
+        lastStatus.current = j.current || null;
       }
       lastStatus.paused = !!j.paused;
       lastStatus.loop = j.loop || j.loop_mode || 'none';
@@ -573,40 +1813,32 @@ INDEX_HTML = """
   }
 
   // seleciona faixa pelo ID (chamada ao clicar em um item da playlist)
-  async function selectTrack(desiredId, desiredIndex, liElement){
+  async function selectTrack(desiredId, desiredIndex){
     if(!desiredId) return;
     showLoader('loaderSelect', true);
     // otimistic UI
-    lastStatus.index = desiredIndex;
+    setOptimisticIndex(desiredIndex);
     renderFromLastStatus();
     suppressRefreshUntil = Date.now() + 2500;
 
-    // força o navegador a recarregar o stream
-    if (player) {
-        const currentSrc = '/stream?t=' + Date.now();
-        player.pause();
-        player.src = currentSrc;
-        player.load();
-        player.play().catch(() => {});
-    }
-
     try{
       await fetch('/select', { method: 'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify({ id: desiredId }) });
     }catch(e){ console.warn('Erro ao solicitar seleção direta', e); }
 
     try{ await callEndpoint('/play'); }catch(e){}
+    ensureStream();
 
     const timeoutAt = Date.now()+3500;
     while(Date.now()<timeoutAt){
       await refreshStatus();
-      if(lastStatus.playlist[lastStatus.index] && lastStatus.playlist[lastStatus.index].id === desiredId) break;
+      if(lastStatus.current && lastStatus.current.id === desiredId) break;
       await new Promise(r=>setTimeout(r, 150));
     }
 
     showLoader('loaderSelect', false);
     renderFromLastStatus();
     // garante que o item selecionado fique visível
-    try{ const pl = document.getElementById('pl'); const itm = pl.children[ lastStatus.index ]; if(itm) itm.scrollIntoView({behavior:'smooth', block:'center'}); }catch(e){}
+    scrollToIndex(lastStatus.index, true);
   }
 
   document.addEventListener('DOMContentLoaded', ()=>{
@@ -617,14 +1849,21 @@ INDEX_HTML = """
     document.getElementById('btnPrev').addEventListener('click', ()=>doControl('/prev'));
     document.getElementById('btnRescan').addEventListener('click', ()=>rescan());
     document.getElementById('loop').addEventListener('change', ()=>setLoop());
-    document.getElementById('btnScrollToCurrent').addEventListener('click', ()=>{
-      const pl = document.getElementById('pl');
-      const items = pl.children;
-      const idx = lastStatus.index;
-      if(items && items[idx]){
-        items[idx].scrollIntoView({behavior:'smooth', block:'center'});
-      }
+    document.getElementById('btnScrollToCurrent').addEventListener('click', ()=>scrollToIndex(lastStatus.index, true));
+
+    const pl = document.getElementById('pl');
+    // um único listener para todas as linhas
+    pl.addEventListener('click', (ev)=>{
+      const row = ev.target.closest('.row');
+      if(row && row.dataset.id) selectTrack(row.dataset.id, Number(row.dataset.index));
+    });
+    let scrollPending = false;
+    pl.addEventListener('scroll', ()=>{
+      if(scrollPending) return;
+      scrollPending = true;
+      requestAnimationFrame(()=>{ scrollPending = false; renderWindow(); });
     });
+    window.addEventListener('resize', ()=>renderWindow());
 
     refreshStatus();
     setInterval(refreshStatus, 900);
@@ -640,21 +1879,16 @@ INDEX_HTML = """
 
     player.addEventListener('ended', () => {
         console.log('Stream ended — reconnecting...');
-        setTimeout(() => {
-            player.src = '/stream?t=' + Date.now(); // força nova conexão
-            player.load();
-            player.play().catch(()=>{});
-        }, 500);
+        scheduleReconnect();
     });
 
     player.addEventListener('error', () => {
         console.warn('Stream error — reconnecting...');
-        setTimeout(() => {
-            player.src = '/stream?t=' + Date.now();
-            player.load();
-            player.play().catch(()=>{});
-        }, 500);
+        scheduleReconnect();
     });
+
+    // conexão aceita e tocando: a próxima falha volta a esperar pouco
+    player.addEventListener('playing', () => { retryDelay = 0; });
   });
 </script>
 </body>
@@ -663,13 +1897,18 @@ INDEX_HTML = """
 
 @app.route("/")
 def index_page():
-    return render_template_string(INDEX_HTML)
+    return render_template_string(INDEX_HTML, retry_after=RETRY_AFTER_SECONDS)
 
 
 @app.route("/files")
 def list_files():
-    scan_playlist()
-    return jsonify([{ 'id': p['id'], 'name': p['name'] } for p in playlist])
+    """Playlist atual. Não reescaneia a pasta: para isso existe /rescan."""
+
+    def build():
+        with state_lock:
+            return [{ 'id': p['id'], 'name': p['name'] } for p in playlist]
+
+    return cached_response(("files",), (playlist_version,), build)
 
 
 @app.route("/rescan", methods=["GET","POST"])
@@ -678,6 +1917,58 @@ def rescan():
     return jsonify({"status":"scanned", "count": n})
 
 
+def _archive_path(name):
+    if not ARCHIVE_FOLDER or not name.endswith(".mp3") or os.path.basename(name) != name:
+        abort(404)
+    path = os.path.join(ARCHIVE_FOLDER, name)
+    if not os.path.isfile(path):
+        abort(404)
+    return path
+
+
+@app.route("/archive")
+def archive_list():
+    """Lista os segmentos gravados (mais recentes primeiro)."""
+    if not ARCHIVE_FOLDER or not os.path.isdir(ARCHIVE_FOLDER):
+        return jsonify([])
+    names = sorted((n for n in os.listdir(ARCHIVE_FOLDER) if n.endswith(".mp3")), reverse=True)
+    out = []
+    for n in names:
+        try:
+            size = os.path.getsize(os.path.join(ARCHIVE_FOLDER, n))
+        except OSError:
+            continue
+        out.append({ 'name': n, 'size': size, 'seconds': size // bytes_per_second() })
+    return jsonify(out)
+
+
+@app.route("/archive/<name>")
+def archive_file(name):
+    """Serve um segmento com suporte a Range; o corpo vai direto do disco
+    (wsgi.file_wrapper/sendfile quando o servidor oferece), sem ler para a memória."""
+    _archive_path(name)
+    return send_from_directory(ARCHIVE_FOLDER, name, mimetype='audio/mpeg', conditional=True)
+
+
+@app.route("/archive/<name>/index")
+def archive_index(name):
+    """Faixas do segmento com o offset (em bytes e segundos) onde cada uma começa."""
+    path = _archive_path(name)
+    entries = []
+    try:
+        with open(path + ".idx", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entry['seconds'] = entry.get('offset', 0) / bytes_per_second()
+                entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return jsonify(entries)
+
+
 @app.route("/debug")
 def debug():
     exists = os.path.exists(MUSIC_FOLDER)
@@ -724,6 +2015,7 @@ def control():
             loop_mode = "none"
         else:
             return jsonify({"error": "Unknown action"}), 400
+        touch_state()
 
         current = playlist[index] if playlist else None
 
@@ -750,14 +2042,20 @@ def get_local_ip():
 # Tkinter controls atualizados para exibir ID
 def start_tkinter_controls():
     """Janela Tkinter com tema escuro, playlist rolável e nomes de músicas em fonte maior."""
+    # import tardio: o modo headless não depende de tkinter
+    import tkinter as tk
+    from tkinter import ttk
+
     def set_play():
         with state_lock:
             globals()['paused'] = False
+            touch_state()
         stop_loading()
 
     def set_pause():
         with state_lock:
             globals()['paused'] = True
+            touch_state()
         stop_loading()
 
     def do_next():
@@ -766,6 +2064,7 @@ def start_tkinter_controls():
                 globals()['action_pending'] = 'next'
                 skip_event.set()
                 globals()['paused'] = False
+                touch_state()
         start_loading()
 
     def do_prev():
@@ -774,6 +2073,7 @@ def start_tkinter_controls():
                 globals()['action_pending'] = 'prev'
                 skip_event.set()
                 globals()['paused'] = False
+                touch_state()
         start_loading()
 
     def set_loop(mode):
@@ -784,6 +2084,7 @@ def start_tkinter_controls():
                 globals()['loop_mode'] = 'all'
             else:
                 globals()['loop_mode'] = 'none'
+            touch_state()
 
     def do_rescan():
         start_loading('Rescan...')
@@ -803,6 +2104,7 @@ def start_tkinter_controls():
             globals()['action_pending_index'] = idx
             skip_event.set()
             globals()['paused'] = False
+            touch_state()
         start_loading('Trocando...')
 
     def start_loading(text='Carregando...'):
@@ -813,41 +2115,71 @@ def start_tkinter_controls():
         loader_var.set('')
         loader_label.pack_forget()
 
+    # o que a janela está mostrando; comparado com as versões do estado a cada tick
+    shown = { 'state': -1, 'playlist': -1, 'rows': [], 'current': None, 'clients': None }
+
+    def apply_rows(rows):
+        """Aplica na Listbox só a diferença entre as linhas exibidas e as novas
+        (prefixo e sufixo comuns ficam intactos)."""
+        old = shown['rows']
+        n = min(len(old), len(rows))
+        pre = 0
+        while pre < n and old[pre] == rows[pre]:
+            pre += 1
+        suf = 0
+        while suf < n - pre and old[-1-suf] == rows[-1-suf]:
+            suf += 1
+        if len(old) - suf > pre:
+            lb.delete(pre, len(old) - suf - 1)
+        added = rows[pre:len(rows) - suf]
+        if added:
+            lb.insert(pre, *added)
+        # linha destacada: acompanha o deslocamento se estava no sufixo, some se foi trocada
+        cur = shown['current']
+        if cur is not None and cur >= pre:
+            shown['current'] = cur + len(rows) - len(old) if cur >= len(old) - suf else None
+        shown['rows'] = rows
+
     def update_ui():
+        clients_count = len(clients)
+        if clients_count != shown['clients']:
+            shown['clients'] = clients_count
+            clients_var.set(f'Clientes: {clients_count}')
+        if state_version == shown['state']:
+            return
+
+        # só copia sob o lock; os widgets são tocados depois de soltá-lo
         with state_lock:
-            pl_copy = list(playlist)
-            cur_index = index if playlist else 0
+            sv, pv = state_version, playlist_version
+            pl_copy = list(playlist) if pv != shown['playlist'] else None
+            cur_index = index if playlist else None
+            cur_item = playlist[index] if playlist else None
             cur_paused = globals().get('paused', True)
             lm = globals().get('loop_mode', 'none')
-            clients_count = len(clients)
-
-        try:
-            view_pos = lb.yview()[0]
-        except Exception:
-            view_pos = 0.0
 
-        lb.delete(0, tk.END)
-        for i, p in enumerate(pl_copy):
-            display = f"{p['id']} - {p['name']}"
-            lb.insert(tk.END, display)
-            if i == cur_index:
-                lb.itemconfig(i, fg='#bfeee0')
+        if pl_copy is not None:
+            apply_rows([f"{p['id']} - {p['name']}" for p in pl_copy])
+            shown['playlist'] = pv
 
-        try:
-            if pl_copy:
+        if cur_index != shown['current']:
+            try:
+                if shown['current'] is not None:
+                    lb.itemconfig(shown['current'], fg='#d7e6f6')
                 lb.selection_clear(0, tk.END)
-                lb.selection_set(cur_index)
-                lb.yview_moveto(view_pos)
-        except Exception:
-            pass
+                if cur_index is not None:
+                    lb.itemconfig(cur_index, fg='#bfeee0')
+                    lb.selection_set(cur_index)
+            except Exception:
+                pass
+            shown['current'] = cur_index
 
         status_text = ('⏸️ Pausado' if cur_paused else '▶️ Tocando') + f" | Loop: {lm} | "
-        if pl_copy:
-            status_text += f"{pl_copy[cur_index]['id']} - {pl_copy[cur_index]['name']}"
+        if cur_item:
+            status_text += f"{cur_item['id']} - {cur_item['name']}"
         else:
             status_text += '—'
         status_var.set(status_text)
-        clients_var.set(f'Clientes: {clients_count}')
+        shown['state'] = sv
 
     # --- Interface Tkinter ---
     root = tk.Tk()
@@ -920,7 +2252,7 @@ def start_tkinter_controls():
             update_ui()
         except Exception:
             pass
-        root.after(500, periodic)
+        root.after(250, periodic)
 
     periodic()
     root.mainloop()
@@ -930,7 +2262,25 @@ def start_flask():
     log(f"Estação iniciada. Acesse http://{ip}:{PORT}/ na sua rede.")
     app.run(host="0.0.0.0", port=PORT, threaded=True)
 
-if __name__ == "__main__":
+def apply_latency_profile(name):
+    """Aplica um perfil de latência; deve ser chamada antes de start_broadcaster()."""
+    global LATENCY_PROFILE
+    LATENCY_PROFILE = name
+    if name == "low":
+        globals().update(LOW_LATENCY_SETTINGS)
+    log(f"perfil de latência: {name}")
+
+
+def main(argv=None):
+    global paused
+    parser = argparse.ArgumentParser(description="Rádio caseira")
+    parser.add_argument("--headless", action="store_true",
+                        help="sem janela de controles (servidor); não importa tkinter")
+    parser.add_argument("--latency", choices=("normal", "low"), default=LATENCY_PROFILE,
+                        help="perfil de latência (low: buffers rasos, chunks de um frame)")
+    args = parser.parse_args(argv)
+    apply_latency_profile(args.latency)
+
     log(f"Pasta configurada: {MUSIC_FOLDER}")
     if not os.path.isdir(MUSIC_FOLDER):
         try:
@@ -938,9 +2288,19 @@ if __name__ == "__main__":
             log("Pasta criada pois não existia.")
         except Exception as e:
             log(f"Falha ao criar pasta: {e}")
-    scan_playlist()
+    # começa a tocar a partir do índice salvo; o scan completo roda em segundo plano
+    load_playlist_cache()
+    threading.Thread(target=scan_playlist, daemon=True).start()
     with state_lock:
         paused = False
     start_broadcaster()
+
+    if args.headless:
+        start_flask()
+        return
     threading.Thread(target=start_flask, daemon=True).start()
-    start_tkinter_controls()
\ No newline at end of file
+    start_tkinter_controls()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
\ No newline at end of file